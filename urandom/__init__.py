@@ -13,68 +13,28 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-from typing import Dict, Union, Tuple, List
-from base64 import b64encode, b16encode, b32encode, b85encode
-from os import urandom as sys_urandom
 import random
 
-from base65536 import encode as b65536encode
-
 from mautrix.types import (EventType, RoomTopicStateEventContent, TextMessageEventContent,
                            MessageType)
 
 from maubot import Plugin, MessageEvent
 from maubot.handlers import command
 
-Args = Dict[str, Union[bool, str]]
-sys_rand = random.SystemRandom()
+from ._core import (Args, NullCodepointError, compile_urange, encoders, entropy_pool, parse_args,
+                    sys_rand, urandom_choices)
 
 DEFAULT_LENGTH = 64
 MAX_LENGTH = 512
 DEFAULT_BASE = "64"
 
 
-def parse_args(args: str) -> Tuple[str, Args]:
-    args = (arg.split("=", 1)
-            for arg in args.split(" ")
-            if arg)
-    return "", {arg[0].lower(): arg[1] if len(arg) == 2 else True
-                for arg in args}
-
-
-def parse_urange(val: str) -> Tuple[int, int]:
-    if "-" not in val:
-        if val.startswith("U+"):
-            char = int(val[2:], 16)
-        else:
-            char = _parse_urange_part(val)
-        return char, char
-    if val.upper().startswith("U+"):
-        start, end = val[2:].split("-")
-        return int(start, 16), int(end, 16)
-    start, end = val.split("-")
-    return _parse_urange_part(start), _parse_urange_part(end)
-
-
-def _parse_urange_part(val: str) -> int:
-    if val.startswith("0x"):
-        return int(val, 16)
-    elif val.startswith("0b"):
-        return int(val, 2)
-    elif val.startswith("\\u"):
-        return ord(val.encode("utf-8").decode("unicode-escape"))
-    try:
-        return ord(val)
-    except TypeError:
-        return int(val)
-
-
 HELP = """**Usage:** `!urandom [args...]`
 
 Output format args:
 
-* `base=<base>` - The base to encode the random data in. Options: `raw`, `16`, `32`, `64`, `65536`.
-   The default is `base=64`.
+* `base=<base>` - The base to encode the random data in. Options: `raw`, `16`, `32`, `64`, `64url`,
+   `65536`. The default is `base=64`.
 * `alphabet=<str>` - The set of characters to create a random string from.
    Available options: `space=<chr>`, `shuffle`.
 * `urange=<range...>` - Unicode character range(s) to create a random string from.
@@ -93,7 +53,8 @@ HELP_BASE = """**Usage:** `!urandom base=<base> [len=<int>]`
 This is the default format if `alphabet` or `urange` isn't specified. The default is base64.
 In this mode, `len` specifies the number of bytes to generate, not the length of the output string.
 
-Currently available bases: `raw` (python hex encoding), `16`, `32`, `64`, `65536`.
+Currently available bases: `raw` (python hex encoding), `16`, `32`, `64`, `64url` (URL-safe
+base64), `65536`.
 """
 
 HELP_ALPHABET = """**Usage:** `!urandom alphabet=<str> [space=<char>] [shuffle] [len=<int>]`
@@ -186,6 +147,7 @@ class RandomBot(Plugin):
         elif length < 0:
             await evt.reply("Invalid length")
             return
+        length = length or DEFAULT_LENGTH
 
         rand = sys_rand
         if "seed" in args:
@@ -206,53 +168,30 @@ class RandomBot(Plugin):
                 data = list(alphabet)
                 rand.shuffle(data)
                 randomness = "".join(data)
+            elif rand == sys_rand:
+                randomness = urandom_choices(alphabet, length)
             else:
-                randomness = "".join(rand.choices(alphabet, k=length or DEFAULT_LENGTH))
+                randomness = "".join(rand.choices(alphabet, k=length))
         elif "urange" in args:
-            ranges: List[Tuple[int, int]] = []
-            weights: List[int] = []
             try:
-                lim = range(0x110000)
-                for urange in args["urange"].split(","):
-                    start, end = parse_urange(urange.strip())
-                    if start == 0 or end == 0:
-                        await evt.reply(
-                            'Exception in thread "main" java.lang.NullPointerException  \n'
-                            '    at Urandom.handle_command(Urandom.java:216)')
-                        return
-                    if start not in lim:
-                        raise ValueError("range start not in range(0x110000)")
-                    elif end not in lim:
-                        raise ValueError("range end not in range(0x110000)")
-                    ranges.append((start, end + 1))
-                    weights.append(end - start + 1)
+                table = compile_urange(args["urange"])
+            except NullCodepointError:
+                await evt.reply('Exception in thread "main" java.lang.NullPointerException  \n'
+                                '    at Urandom.handle_command(Urandom.java:216)')
+                return
             except (KeyError, ValueError):
                 await evt.reply("Invalid unicode range")
                 self.log.exception("Invalid unicode range")
                 return
-            randomness = "".join(chr(rand.randrange(start, end))
-                                 for start, end
-                                 in rand.choices(ranges, weights, k=length or DEFAULT_LENGTH))
+            randomness = table.sample(rand, length)
         else:
-            urandom = (sys_urandom if rand == sys_rand
-                       else lambda n: bytes(rand.randint(0, 255) for i in range(n)))
-            randomness = urandom(length or DEFAULT_LENGTH)
-
-            base = args.get("base", DEFAULT_BASE)
-            if base == "raw":
-                randomness = str(randomness)
-            elif base == "16" or base == "hex":
-                randomness = b16encode(randomness).decode("utf-8")
-            elif base == "32":
-                randomness = b32encode(randomness).decode("utf-8").rstrip("=")
-            elif base == "64":
-                randomness = b64encode(randomness).decode("utf-8").rstrip("=")
-            elif base == "85":
-                randomness = b85encode(randomness).decode("utf-8")
-            elif base == "65536":
-                randomness = b65536encode(randomness)
-            else:
+            encoder = encoders.get(args.get("base", DEFAULT_BASE))
+            if not encoder:
                 await evt.reply("Unknown base")
+                return
+            urandom = (entropy_pool.get if rand == sys_rand
+                       else lambda n: bytes(rand.randint(0, 255) for i in range(n)))
+            randomness = encoder(urandom(length))
 
         if "topic" in args:
             await self.client.send_state_event(evt.room_id, EventType.ROOM_TOPIC,
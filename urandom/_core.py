@@ -0,0 +1,241 @@
+# urandom - A maubot plugin that generates random strings with /dev/urandom.
+# Copyright (C) 2019 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from typing import Dict, Union, Tuple, List, Callable, Optional
+from base64 import b64encode, b32encode, b85encode
+from os import urandom as sys_urandom
+import os
+from array import array
+from functools import lru_cache
+import random
+import sys
+import re
+
+try:
+    from pybase64 import b64encode_as_string
+except ImportError:
+    def b64encode_as_string(s: bytes, altchars: Optional[bytes] = None) -> str:
+        return b64encode(s, altchars).decode("utf-8")
+
+from base65536 import encode as b65536encode
+
+Args = Dict[str, Union[bool, str]]
+native_utf32 = f"utf-32-{sys.byteorder[0]}e"
+arg_regex = re.compile(r"(?<![^ ])(?=[^ ])([^ =]*)(=[^ ]*)?")
+urange_comma_regex = re.compile(r"\s*,\s*")
+urange_dash_regex = re.compile(r" *- *")
+
+ENTROPY_POOL_SIZE = 8192
+
+_os_getrandom = getattr(os, "getrandom", None)
+
+
+def getrandom(n: int) -> bytes:
+    """Read from getrandom directly, falling back to os.urandom when it can't be used."""
+    if not _os_getrandom:
+        return sys_urandom(n)
+    try:
+        data = _os_getrandom(n, os.GRND_NONBLOCK)
+    except OSError:
+        # Not initialized yet (EAGAIN), or blocked by seccomp/an old kernel (EPERM, ENOSYS).
+        return sys_urandom(n)
+    # Reads over 256 bytes may be cut short by signals.
+    return data if len(data) == n else data + sys_urandom(n - len(data))
+
+
+class EntropyPool:
+    """A buffer in front of /dev/urandom so that small reads don't each need a syscall."""
+
+    __slots__ = ("buf", "idx")
+
+    buf: bytearray
+    idx: int
+
+    def __init__(self) -> None:
+        self.buf = bytearray()
+        self.idx = 0
+
+    def get(self, n: int) -> bytes:
+        if n > ENTROPY_POOL_SIZE:
+            return sys_urandom(n)
+        end = self.idx + n
+        if end > len(self.buf):
+            self.buf = bytearray(getrandom(ENTROPY_POOL_SIZE))
+            self.idx, end = 0, n
+        data = bytes(self.buf[self.idx:end])
+        # Don't keep bytes that have already been handed out in memory.
+        self.buf[self.idx:end] = bytes(n)
+        self.idx = end
+        return data
+
+
+class PooledRandom(random.SystemRandom):
+    """A SystemRandom that reads from the entropy pool instead of calling os.urandom directly."""
+
+    def random(self) -> float:
+        return (int.from_bytes(entropy_pool.get(7), "big") >> 3) * 2 ** -53
+
+    def getrandbits(self, k: int) -> int:
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        numbytes = (k + 7) // 8
+        return int.from_bytes(entropy_pool.get(numbytes), "big") >> (numbytes * 8 - k)
+
+    def randbytes(self, n: int) -> bytes:
+        return entropy_pool.get(n)
+
+
+entropy_pool = EntropyPool()
+sys_rand = PooledRandom()
+if hasattr(os, "register_at_fork"):
+    # A forked child must not hand out the same bytes as its parent.
+    os.register_at_fork(after_in_child=entropy_pool.__init__)
+
+
+def parse_args(args: str) -> Tuple[str, Args]:
+    return "", {key.lower(): value[1:] if value else True
+                for key, value in arg_regex.findall(args)}
+
+
+def parse_urange(val: str) -> Tuple[int, int]:
+    if "-" not in val:
+        if val[:2] in ("U+", "u+"):
+            char = int(val[2:], 16)
+        else:
+            char = _parse_urange_part(val)
+        return char, char
+    if val[:2] in ("U+", "u+"):
+        start, end = urange_dash_regex.split(val[2:])
+        return int(start, 16), int(end, 16)
+    start, end = urange_dash_regex.split(val)
+    return _parse_urange_part(start), _parse_urange_part(end)
+
+
+_urange_prefixes: Dict[str, Callable[[str], int]] = {
+    "0x": lambda val: int(val, 16),
+    "0b": lambda val: int(val, 2),
+    "\\u": lambda val: ord(val.encode("utf-8").decode("unicode-escape")),
+}
+
+
+def _parse_urange_part(val: str) -> int:
+    parse_prefixed = _urange_prefixes.get(val[:2])
+    if parse_prefixed:
+        return parse_prefixed(val)
+    elif len(val) == 1:
+        return ord(val)
+    return int(val)
+
+
+@lru_cache(maxsize=128)
+def _alphabet_tables(alphabet: str) -> Tuple[bytes, Dict[int, str]]:
+    size = len(alphabet)
+    # Bytes at or above the largest multiple of the alphabet size are dropped to avoid modulo bias.
+    limit = 256 - 256 % size
+    return bytes(range(limit, 256)), {i: alphabet[i % size] for i in range(limit)}
+
+
+def urandom_choices(alphabet: str, k: int) -> str:
+    if not 0 < len(alphabet) <= 256:
+        # A single byte can't index larger alphabets.
+        return "".join(sys_rand.choices(alphabet, k=k))
+    rejected, table = _alphabet_tables(alphabet)
+    result = ""
+    while len(result) < k:
+        raw = entropy_pool.get(k - len(result))
+        result += raw.translate(None, rejected).decode("latin-1").translate(table)
+    return result
+
+
+class AliasTable:
+    """Walker alias table for picking weighted unicode ranges in constant time."""
+
+    ranges: List[Tuple[int, int]]
+    thresholds: List[int]
+    alias: List[int]
+
+    def __init__(self, ranges: List[Tuple[int, int]]) -> None:
+        # Vose's algorithm, done with integers so the probabilities are exact.
+        self.ranges = ranges
+        count = len(ranges)
+        total = sum(end - start for start, end in ranges)
+        scaled = [(end - start) * count for start, end in ranges]
+        small = [i for i, weight in enumerate(scaled) if weight < total]
+        large = [i for i, weight in enumerate(scaled) if weight >= total]
+        self.alias = list(range(count))
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.alias[less] = more
+            scaled[more] -= total - scaled[less]
+            (small if scaled[more] < total else large).append(more)
+        for i in small + large:
+            scaled[i] = total
+        self.thresholds = [(weight << 64) // total for weight in scaled]
+
+    def sample(self, rand: random.Random, k: int) -> str:
+        count = len(self.ranges)
+        ranges, thresholds, alias = self.ranges, self.thresholds, self.alias
+        # Draw all the randomness at once: two 64-bit words per character, the first picks the
+        # bucket and the biased coin, the second picks the codepoint within the range.
+        words = memoryview(rand.getrandbits(128 * k).to_bytes(16 * k, "little")).cast("Q")
+        codepoints = array("I")
+        append = codepoints.append
+        for i in range(0, 2 * k, 2):
+            bucket, coin = divmod(words[i] * count, 1 << 64)
+            if coin >= thresholds[bucket]:
+                bucket = alias[bucket]
+            start, end = ranges[bucket]
+            append(start + words[i + 1] % (end - start))
+        return codepoints.tobytes().decode(native_utf32, "surrogatepass")
+
+
+class NullCodepointError(ValueError):
+    pass
+
+
+@lru_cache(maxsize=128)
+def compile_urange(spec: str) -> AliasTable:
+    ranges: List[Tuple[int, int]] = []
+    lim = range(0x110000)
+    for urange in urange_comma_regex.split(spec.strip()):
+        start, end = parse_urange(urange)
+        if start == 0 or end == 0:
+            raise NullCodepointError("range contains null")
+        if start not in lim:
+            raise ValueError("range start not in range(0x110000)")
+        elif end not in lim:
+            raise ValueError("range end not in range(0x110000)")
+        elif end < start:
+            raise ValueError("range end before range start")
+        ranges.append((start, end + 1))
+    return AliasTable(ranges)
+
+
+def hex_encode(data: bytes) -> str:
+    return data.hex().upper()
+
+
+encoders: Dict[str, Callable[[bytes], str]] = {
+    "raw": str,
+    "16": hex_encode,
+    "hex": hex_encode,
+    # Unpadded base32 and base64 are always ceil(8n/5) and ceil(4n/3) characters long, so the
+    # padding can be sliced off instead of stripped.
+    "32": lambda data: b32encode(data)[:(8 * len(data) + 4) // 5].decode("utf-8"),
+    "64": lambda data: b64encode_as_string(data)[:(4 * len(data) + 2) // 3],
+    "64url": lambda data: b64encode_as_string(data, b"-_")[:(4 * len(data) + 2) // 3],
+    "85": lambda data: b85encode(data).decode("utf-8"),
+    "65536": b65536encode,
+}